@@ -2,13 +2,14 @@
 
 from dataclasses import dataclass, field, asdict
 from typing import Callable, Dict, List, Tuple, Optional, Any
-import json, math, re, textwrap, random, os, sys
+import json, math, re, textwrap, random, os, sys, time, threading, inspect
 import math
 from collections import Counter, defaultdict
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 from prompting_techniques import make_prompt, parse_action
+import profiling
 
 @dataclass
 class Step:
@@ -21,29 +22,93 @@ class AgentConfig:
     max_steps: int = 6
     allow_tools: Tuple[str, ...] = ("search",)
     verbose: bool = True
+    # Latency budget: with a deadline, each generation gets fewer new tokens as the budget runs down,
+    # is cut off when time is up, and the run returns the best answer found so far
+    deadline_s: Optional[float] = None  # wall-clock seconds per run; None means no limit
+    max_new_tokens: int = 200           # per generation when there is time to spare
+    min_new_tokens: int = 24            # a step that cannot afford this many tokens is not started
+    est_sec_per_token: float = 0.05     # initial step-cost guess, replaced by measured step times
+
+@dataclass
+class RunState:
+    # Everything that changes during one run lives here, so one agent can serve many runs at once
+    user_query: str
+    trajectory: List[Step] = field(default_factory=list)
+    final_answer: Optional[str] = None
+    started: float = field(default_factory=time.perf_counter)
+    deadline: Optional[float] = None    # absolute perf_counter() time
+    step_cost: Optional[float] = None   # running estimate of seconds per full-length step
+    timeouts: int = 0                   # generations cut short or skipped for lack of time
+    timed_out: bool = False
+    best_hit: Optional[str] = None      # top title of the latest search, the fallback answer
 
 class ReActAgent:
+    # The agent itself only holds the shared, read-only pieces (model, tools, config) and is safe to
+    # call from several threads; each call to run() works on its own RunState.
     def __init__(self, llm: Callable[[str], str], tools: Dict[str, Dict[str, Any]], config: AgentConfig | None=None):
         self.llm = llm
         self.tools = tools
         self.config = config or AgentConfig()
-        self.trajectory: List[Step] = []
+        # Only LLMs that take generation limits (like hf_llm) can be shrunk or cut off mid-generation
+        try:
+            params = inspect.signature(llm).parameters
+            self._llm_takes_budget = "max_new_tokens" in params and "max_time" in params
+        except (TypeError, ValueError):
+            self._llm_takes_budget = False
 
-    def run(self, user_query: str) -> Dict[str, Any]:
-        self.trajectory.clear()
+    def _step_budget(self, state: RunState) -> Optional[Dict[str, Any]]:
+        """Generation limits for the next step, or None if the deadline leaves no room for one."""
+        cfg = self.config
+        if state.deadline is None:
+            return {}
+        remaining = state.deadline - time.perf_counter()
+        step_cost = state.step_cost or cfg.est_sec_per_token * cfg.max_new_tokens
+        # Scale the token allowance down once the remaining time no longer covers a full step
+        tokens = min(cfg.max_new_tokens, int(cfg.max_new_tokens * remaining / step_cost))
+        if state.step_cost is None:
+            # Nothing measured yet and the initial guess may be far off: always try one step
+            # (max_time still cuts it off at the deadline)
+            tokens = max(tokens, cfg.min_new_tokens)
+        if remaining <= 0 or tokens < cfg.min_new_tokens:
+            return None
+        if not self._llm_takes_budget and state.step_cost is not None and remaining < state.step_cost:
+            return None  # this LLM cannot be shortened or cut off, so only start steps that fit
+        return {"max_new_tokens": tokens, "max_time": remaining} if self._llm_takes_budget else {}
+
+    @profiling.profile_request("agent.run")
+    def run(self, user_query: str, deadline_s: Optional[float] = None) -> Dict[str, Any]:
+        state = RunState(user_query)
+        trajectory = state.trajectory
+        deadline_s = deadline_s if deadline_s is not None else self.config.deadline_s
+        if deadline_s is not None:
+            state.deadline = state.started + deadline_s
 
         step_idx = 0
-        final_answer = None
         
         for step_idx in range(self.config.max_steps):
             if self.config.verbose:
                 print(f"--- Step {step_idx + 1} ---")
+
+            budget = self._step_budget(state)
+            if budget is None:
+                state.timeouts += 1
+                state.timed_out = True
+                break
             
             # 1. Format prompt
-            prompt = make_prompt(user_query, self.trajectory)
+            prompt = make_prompt(user_query, trajectory)
             
             # 2. Get LLM response
-            out = self.llm(prompt)
+            step_start = time.perf_counter()
+            out = self.llm(prompt, **budget)
+            elapsed = time.perf_counter() - step_start
+            # Normalise to a full-length step so shrunken steps still update the estimate; LLMs that
+            # take no limits always generate full-length steps
+            full_step = elapsed * self.config.max_new_tokens / budget.get("max_new_tokens", self.config.max_new_tokens)
+            state.step_cost = full_step if state.step_cost is None else 0.5 * (state.step_cost + full_step)
+            if "max_time" in budget and elapsed >= budget["max_time"]:
+                state.timeouts += 1
+                state.timed_out = True
 
             # Expect two lines: Thought:..., Action:...
             t_match = re.search(r"Thought:\s*(.*)", out)
@@ -60,7 +125,7 @@ class ReActAgent:
 
             if not parsed:
                 observation = "Invalid action format. Stopping."
-                self.trajectory.append(Step(thought, action_line, observation))
+                trajectory.append(Step(thought, action_line, observation))
                 break
             
             name, args = parsed
@@ -68,28 +133,30 @@ class ReActAgent:
             # Check if this is a finish action
             if name == "finish":
                 observation = "done"
-                self.trajectory.append(Step(thought, action_line, observation))
+                trajectory.append(Step(thought, action_line, observation))
                 # Extract the answer from args
-                final_answer = args.get("answer", "No answer provided")
+                state.final_answer = args.get("answer", "No answer provided")
                 break
 
             if name not in self.config.allow_tools or name not in self.tools:
                 observation = f"Action '{name}' not allowed or not found."
-                self.trajectory.append(Step(thought, action_line, observation))
+                trajectory.append(Step(thought, action_line, observation))
                 break
 
             # 4. Execute the action
             try:
                 obs_payload = self.tools[name]["fn"](**args)
                 observation = json.dumps(obs_payload, ensure_ascii=False)
+                if isinstance(obs_payload, dict) and obs_payload.get("results"):
+                    state.best_hit = obs_payload["results"][0].get("title")
             except Exception as e:
                 observation = f"Tool error: {e}"
 
-            self.trajectory.append(Step(thought, action_line, observation))
+            trajectory.append(Step(thought, action_line, observation))
 
         # If we didn't find a finish action, try to extract from trajectory
-        if final_answer is None:
-            for step in reversed(self.trajectory):
+        if state.final_answer is None:
+            for step in reversed(trajectory):
                 if "finish[" in step.action or "finish [" in step.action:
                     # Try multiple patterns
                     patterns = [
@@ -100,16 +167,163 @@ class ReActAgent:
                     for pattern in patterns:
                         m = re.search(pattern, step.action)
                         if m:
-                            final_answer = m.group(1)
+                            state.final_answer = m.group(1)
                             break
-                    if final_answer:
+                    if state.final_answer:
                         break
+
+        # Out of time without a finish: the top search hit so far is the best answer we have
+        if state.final_answer is None and state.timed_out:
+            state.final_answer = state.best_hit
             
-        print("DEBUG — trajectory:", self.trajectory)
-        print("DEBUG — final_answer:", final_answer)
+        print("DEBUG — trajectory:", trajectory)
+        print("DEBUG — final_answer:", state.final_answer)
         
         return {
             "question": user_query,
-            "final_answer": final_answer,
-            "steps": [asdict(step) for step in self.trajectory]
-        }
\ No newline at end of file
+            "final_answer": state.final_answer,
+            "steps": [asdict(step) for step in trajectory],
+            "timed_out": state.timed_out,
+            "timeouts": state.timeouts,
+            "budget": budget_report(deadline_s, time.perf_counter() - state.started)
+        }
+
+def budget_report(deadline_s: Optional[float], elapsed_s: float) -> Dict[str, Any]:
+    return {
+        "deadline_s": deadline_s,
+        "elapsed_s": round(elapsed_s, 3),
+        "used": round(elapsed_s / deadline_s, 3) if deadline_s else None
+    }
+
+
+# Step 5: A retrieval fast path in front of the agent
+# Many queries are direct lookups ("apple pie recipe") whose answer is simply the top search hit.
+# The router runs retrieval first and, when the top hit is strong, clearly ahead of the next distinct
+# recipe, and covers every query word the candidates know about, it returns a finish result directly
+# instead of paying for LLM generations. Everything else falls through to the full ReAct loop.
+
+@dataclass
+class RouterConfig:
+    min_score: float = 0.45   # top hit must reach this cosine score
+    min_margin: float = 0.05  # ...and beat the best hit with a different title by this much
+    k: int = 3                # hits shown in the synthetic observation
+    candidates: int = 10      # hits inspected when deciding
+    verbose: bool = True
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-zA-Z0-9']+", str(text).lower()))
+
+class RetrievalRouter:
+    # query_words_fn should read the query the way search_fn does: when the search corrects misspellings,
+    # the coverage check must see the corrected words ("chiken" never appears in any hit's text)
+    def __init__(self, agent: ReActAgent, search_fn: Callable[..., List[Dict[str, Any]]], config: RouterConfig | None=None,
+                 query_words_fn: Optional[Callable[[str], List[str]]] = None):
+        self.agent = agent
+        self.search_fn = search_fn
+        self.config = config or RouterConfig()
+        self.query_words_fn = query_words_fn
+        self.stats = {"queries": 0, "fast_path": 0, "fast_path_time": 0.0, "full_time": 0.0}
+        self._stats_lock = threading.Lock()  # run() may be called from several threads
+
+    def _confident_hit(self, user_query: str, hits: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not hits or hits[0]["score"] < self.config.min_score:
+            return None
+        top = hits[0]
+        # Duplicate recipes share a score, so compare against the first hit with another title
+        runner_up = next((h["score"] for h in hits[1:] if h["recipe"] != top["recipe"]), 0.0)
+        if top["score"] - runner_up < self.config.min_margin:
+            return None
+        # A query word that other candidates match but the top hit lacks ("chicken" in "chicken rice"
+        # against "Coconut Rice") means the query is asking for something else
+        query_words = set(self.query_words_fn(user_query)) if self.query_words_fn else _words(user_query)
+        known = set().union(*(_words(h.get("text", "")) for h in hits)) & query_words
+        if not known <= _words(top.get("text", "")):
+            return None
+        return top
+
+    def hit_rate(self) -> float:
+        return self.stats["fast_path"] / self.stats["queries"] if self.stats["queries"] else 0.0
+
+    def saved_latency(self) -> float:
+        # Estimated seconds saved: each fast-path query would have cost an average full-loop run
+        full_runs = self.stats["queries"] - self.stats["fast_path"]
+        if not full_runs:
+            return 0.0
+        avg_full = self.stats["full_time"] / full_runs
+        return self.stats["fast_path"] * avg_full - self.stats["fast_path_time"]
+
+    def run(self, user_query: str, deadline_s: Optional[float] = None) -> Dict[str, Any]:
+        start = time.perf_counter()
+        hits = self.search_fn(user_query, k=max(self.config.k, self.config.candidates))
+        top = self._confident_hit(user_query, hits)
+
+        if top is None:
+            deadline_s = deadline_s if deadline_s is not None else self.agent.config.deadline_s
+            if deadline_s is not None:
+                deadline_s -= time.perf_counter() - start  # retrieval already spent part of the budget
+            result = self.agent.run(user_query, deadline_s=deadline_s)
+            if result.get("timed_out") and not result.get("final_answer") and hits and hits[0]["score"] > 0:
+                result["final_answer"] = hits[0]["recipe"]  # the router's own search is the best fallback
+            with self._stats_lock:
+                self.stats["queries"] += 1
+                self.stats["full_time"] += time.perf_counter() - start
+            if self.config.verbose:
+                print(f"[router] full loop — hit rate {self.hit_rate():.1%}, est. latency saved {self.saved_latency():.1f}s")
+            return result
+
+        # Synthetic trajectory in the same shape the agent would have produced
+        answer = str(top["recipe"])
+        quoted_query = user_query.replace('"', "'")
+        quoted_answer = answer.replace('"', "'")
+        observation = json.dumps({
+            "tool": "search",
+            "query": user_query,
+            "results": [
+                {"id": h["id"], "title": h["recipe"], "score": round(h["score"], 4), "total_time": h.get("total_time", "Unknown")}
+                for h in hits[:self.config.k]
+            ],
+        }, ensure_ascii=False)
+        trajectory = [
+            Step("Retrieval fast path: searching the recipe database directly.",
+                 f'search[query="{quoted_query}", k={self.config.k}]', observation),
+            Step(f"The top hit scores {top['score']:.3f}, clearly ahead of the alternatives.",
+                 f'finish[answer="{quoted_answer}"]', "done"),
+        ]
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.stats["queries"] += 1
+            self.stats["fast_path"] += 1
+            self.stats["fast_path_time"] += elapsed
+        if self.config.verbose:
+            print(f"[router] fast path hit ({elapsed * 1000:.1f} ms) — hit rate {self.hit_rate():.1%}, "
+                  f"est. latency saved {self.saved_latency():.1f}s")
+
+        deadline_s = deadline_s if deadline_s is not None else self.agent.config.deadline_s
+        return {
+            "question": user_query,
+            "final_answer": answer,
+            "steps": [asdict(step) for step in trajectory],
+            "timed_out": False,
+            "timeouts": 0,
+            "budget": budget_report(deadline_s, elapsed)
+        }
+
+
+if __name__ == "__main__":
+    # Routing check with a stub LLM: direct lookups take the fast path, while queries the top hit only
+    # partly covers go to the full loop, also when they are misspelled
+    import knowledge_base as kb
+
+    def stub_llm(prompt: str) -> str:
+        return 'Thought: (stub)\nAction: finish[answer="(full loop)"]'
+
+    agent = ReActAgent(stub_llm, kb.TOOLS, AgentConfig(verbose=False))
+    router = RetrievalRouter(agent, kb.search_corpus, RouterConfig(verbose=False), kb.query_words)
+    for query, expect_fast in [("banana bread", True), ("banan bread", True),
+                              ("chicken rice", False), ("chiken ricee", False)]:
+        fast_before = router.stats["fast_path"]
+        answer = router.run(query)["final_answer"]
+        fast = router.stats["fast_path"] > fast_before
+        print(f"{query!r}: {'fast path' if fast else 'full loop'} -> {answer}")
+        assert fast == expect_fast, f"{query!r} should {'' if expect_fast else 'not '}take the fast path"
@@ -5,6 +5,7 @@ import os
 import ast
 import traceback
 import re
+import time
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 src_path = os.path.join(current_dir, 'src')
@@ -14,6 +15,8 @@ try:
     import agent_system as ags
     import knowledge_base as kb
     import language_model as lm
+    import serving
+    import profiling
 except ImportError as e:
     st.error(f"Error importing modules: {e}")
     st.info("Make sure your project structure has 'src/' containing agent_system.py, knowledge_base.py, etc.")
@@ -25,12 +28,19 @@ st.set_page_config(
     layout="wide"
 )
 
+AGENT_DEADLINE_S = 60  # per search, including time spent waiting for a free worker
+
 @st.cache_resource
 def load_agent():
-    """Load and cache the agent"""
-    config = ags.AgentConfig(max_steps=6, verbose=True)
+    """Load and cache the agent, fronted by the retrieval fast path"""
+    config = ags.AgentConfig(max_steps=6, verbose=True, deadline_s=AGENT_DEADLINE_S)
     agent_instance = ags.ReActAgent(lm.LLM, kb.TOOLS, config)
-    return agent_instance
+    return ags.RetrievalRouter(agent_instance, kb.search_corpus, ags.RouterConfig(), kb.query_words)
+
+@st.cache_resource
+def load_server():
+    """One agent shared by every browser session, run on a bounded worker pool"""
+    return serving.AgentServer(load_agent())
 
 @st.cache_data
 def load_recipe_data():
@@ -71,11 +81,98 @@ def parse_ingredients_for_display(ing_data):
         return [ing_data]
     return ["No ingredients listed."]
 
+# Sampled requests also profile this thread: waiting on the agent plus the pandas lookups below
+@profiling.profile_request("app.search")
+def answer_query(user_query):
+    """Run the agent on one query and show its answer with the matching recipe cards"""
+    with st.chat_message("assistant"):
+        with st.spinner("Thinking and searching..."):
+            try:
+                result = server.run(user_query, timeout=30, deadline_s=AGENT_DEADLINE_S)
+                #st.write("DEBUG RESULT:", result)
+
+                final_answer = result.get("final_answer")
+                #st.write("DEBUG final_answer:", final_answer)
+
+                if not final_answer or not isinstance(final_answer, str):
+                    msg = "Sorry — I couldn't find a specific recipe based on that request."
+                    st.error("The agent did not return a valid recipe name.")
+                    st.session_state.messages.append({"role": "assistant", "content": msg})
+                    st.write(msg)
+                else:
+                    # Display answer
+                    st.write(final_answer)
+                    st.session_state.messages.append({"role": "assistant", "content": final_answer})
+
+                    st.markdown("---")
+                    found_match = False
+
+                    # Try to extract recipe names from the answer
+                    # Handle both "Recipe Name" and "You can make Recipe Name by..."
+                    potential_names = []
+
+                    # If answer is a sentence, try to extract recipe name
+                    if "make" in final_answer.lower() or "by" in final_answer.lower():
+                        # Extract the recipe name from sentences like "You can make X by..."
+                        patterns = [
+                            r'make\s+([A-Z][^.!?]*?)(?:\s+by|\s+with|\.|$)',
+                            r'recipe:?\s*([A-Z][^.!?]*?)(?:\.|$)',
+                            r'called\s+([A-Z][^.!?]*?)(?:\.|$)',
+                        ]
+                        for pattern in patterns:
+                            match = re.search(pattern, final_answer)
+                            if match:
+                                potential_names.append(match.group(1).strip())
+
+                    # Also try splitting by comma or period
+                    if not potential_names:
+                        potential_names = [name.strip() for name in re.split(r'[,.]', final_answer)]
+
+                    # Clean and deduplicate
+                    potential_names = [name for name in potential_names if name and len(name) > 3]
+
+                    for potential_name in potential_names:
+                        clean_name = potential_name.strip(".").strip()
+                        match = recipes_data[recipes_data["Name"].str.contains(clean_name, case=False, regex=False)]
+
+                        if not match.empty:
+                            found_match = True
+                            recipe = match.iloc[0]
+
+                            with st.expander(f"📖 View Recipe: {recipe['Name']}", expanded=True):
+                                col1, col2 = st.columns([1, 2])
+
+                                with col1:
+                                    st.metric("Total Time", f"{recipe['Total Time']} m")
+                                    if 'Calories' in recipe:
+                                        st.metric("Calories", f"{recipe['Calories']}")
+                                    if recipe.get('URL'):
+                                        st.link_button("Go to Website", recipe['URL'])
+
+                                with col2:
+                                    st.subheader("Ingredients")
+                                    ing_list = parse_ingredients_for_display(recipe['Ingredients'])
+                                    for item in ing_list:
+                                        st.markdown(f"- {item}")
+
+                                    if 'Directions' in recipe and pd.notna(recipe['Directions']):
+                                        st.subheader("Directions")
+                                        st.caption(str(recipe['Directions'])[:500] + "...")
+
+                    if not found_match:
+                        st.caption("Detailed recipe cards could not be loaded automatically based on the agent's answer.")
+
+            except serving.ServerBusy:
+                st.warning("The assistant is busy with other requests right now. Please try again in a moment.")
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+                st.code(traceback.format_exc())
+
 # ==========================================
 # INITIALIZE
 # ==========================================
 try:
-    agent = load_agent()
+    server = load_server()
     recipes_data = load_recipe_data()
 except Exception as e:
     st.error(f"Failed to load agent or data: {e}")
@@ -98,7 +195,18 @@ with st.sidebar:
     search_btn = st.button("Find Recipes", type="primary")
     
     st.markdown("---")
-    st.markdown("**Agent Status:** Ready")
+    # The model loads in the background (see language_model.HANDLE); direct lookups are answered by the
+    # retrieval fast path even before it is ready, everything else waits for it
+    if lm.HANDLE.ready:
+        st.markdown("**Agent Status:** Ready")
+    elif lm.HANDLE.error is not None:
+        st.markdown("**Agent Status:** Model failed to load")
+        st.caption(str(lm.HANDLE.error))
+    else:
+        st.markdown(f"**Agent Status:** Model {lm.HANDLE.status}...")
+    server_metrics = server.metrics()
+    st.caption(f"{server_metrics['running']} running, {server_metrics['queue_depth']} queued "
+               f"on {server_metrics['workers']} workers.")
     st.caption(f"Loaded {len(recipes_data)} recipes.")
 
 # ==========================================
@@ -127,83 +235,9 @@ if search_btn:
             st.write(user_query)
 
         # Run agent
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking and searching..."):
-                try:
-                    result = agent.run(user_query)
-                    #st.write("DEBUG RESULT:", result)
-                    
-                    final_answer = result.get("final_answer")
-                    #st.write("DEBUG final_answer:", final_answer)
-
-                    if not final_answer or not isinstance(final_answer, str):
-                        msg = "Sorry — I couldn't find a specific recipe based on that request."
-                        st.error("The agent did not return a valid recipe name.")
-                        st.session_state.messages.append({"role": "assistant", "content": msg})
-                        st.write(msg)
-                    else:
-                        # Display answer
-                        st.write(final_answer)
-                        st.session_state.messages.append({"role": "assistant", "content": final_answer})
-
-                        st.markdown("---")
-                        found_match = False
-
-                        # Try to extract recipe names from the answer
-                        # Handle both "Recipe Name" and "You can make Recipe Name by..."
-                        potential_names = []
-                        
-                        # If answer is a sentence, try to extract recipe name
-                        if "make" in final_answer.lower() or "by" in final_answer.lower():
-                            # Extract the recipe name from sentences like "You can make X by..."
-                            patterns = [
-                                r'make\s+([A-Z][^.!?]*?)(?:\s+by|\s+with|\.|$)',
-                                r'recipe:?\s*([A-Z][^.!?]*?)(?:\.|$)',
-                                r'called\s+([A-Z][^.!?]*?)(?:\.|$)',
-                            ]
-                            for pattern in patterns:
-                                match = re.search(pattern, final_answer)
-                                if match:
-                                    potential_names.append(match.group(1).strip())
-                        
-                        # Also try splitting by comma or period
-                        if not potential_names:
-                            potential_names = [name.strip() for name in re.split(r'[,.]', final_answer)]
-                        
-                        # Clean and deduplicate
-                        potential_names = [name for name in potential_names if name and len(name) > 3]
-                        
-                        for potential_name in potential_names:
-                            clean_name = potential_name.strip(".").strip()
-                            match = recipes_data[recipes_data["Name"].str.contains(clean_name, case=False, regex=False)]
-                            
-                            if not match.empty:
-                                found_match = True
-                                recipe = match.iloc[0]
-                                
-                                with st.expander(f"📖 View Recipe: {recipe['Name']}", expanded=True):
-                                    col1, col2 = st.columns([1, 2])
-                                    
-                                    with col1:
-                                        st.metric("Total Time", f"{recipe['Total Time']} m")
-                                        if 'Calories' in recipe:
-                                            st.metric("Calories", f"{recipe['Calories']}")
-                                        if recipe.get('URL'):
-                                            st.link_button("Go to Website", recipe['URL'])
-                                            
-                                    with col2:
-                                        st.subheader("Ingredients")
-                                        ing_list = parse_ingredients_for_display(recipe['Ingredients'])
-                                        for item in ing_list:
-                                            st.markdown(f"- {item}")
-                                            
-                                        if 'Directions' in recipe and pd.notna(recipe['Directions']):
-                                            st.subheader("Directions")
-                                            st.caption(str(recipe['Directions'])[:500] + "...")
-
-                        if not found_match:
-                            st.caption("Detailed recipe cards could not be loaded automatically based on the agent's answer.")
-
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
-                    st.code(traceback.format_exc())
\ No newline at end of file
+        answer_query(user_query)
+
+# Keep polling while the model loads so the status above updates without user interaction
+if not search_btn and not lm.HANDLE.ready and lm.HANDLE.error is None:
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,262 @@
+# Offline weekly plans for many user profiles
+# The interactive agent answers one query at a time; this pipeline precomputes whole weekly meal and
+# workout plans for thousands of profiles in one go:
+#   1. read the profiles (JSONL or CSV), skipping malformed rows with a warning and the profiles already
+#      written by an earlier, interrupted run
+#   2. collect every profile's retrieval sub-queries, deduplicate them across users and run them in bulk
+#      through knowledge_base.search_many
+#   3. pick each user's meals (respecting foods to avoid and the time limit) and workout sessions; users
+#      whose filters leave too few recipes are searched again with more candidates, and any remaining
+#      shortfall is recorded in the plan as "missing_meals"
+#   4. write a short overview for each plan with batched LLM calls
+#   5. append the finished plans to the output file batch by batch, so a rerun resumes where it stopped
+#      (after dropping a plan that an interruption left half-written)
+#
+# Profile fields: user_id, likes, avoid (lists or ";"-separated), max_time (minutes, 0 = no limit),
+# experience_level (1-3 or beginner/intermediate/advanced), goal, days (default 7).
+#
+# Usage:
+#     python batch_plans.py profiles.jsonl plans.jsonl --batch-size 16
+#     python batch_plans.py profiles.csv plans.jsonl --no-llm
+
+import os
+import sys
+import csv
+import json
+import re
+import time
+import argparse
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import knowledge_base as kb
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data")
+GYM_PATH = os.path.join(DATA_PATH, "gym_members_exercise_tracking.csv")
+
+CANDIDATES_PER_QUERY = 10
+REFILL_CANDIDATES = 100     # per sub-query, for users whose filters left too few recipes
+LEVELS = {"beginner": 1, "intermediate": 2, "advanced": 3}
+
+
+# ====== 1. Profiles and checkpoint ======
+def _as_list(value: Any) -> List[str]:
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return []
+    return [v.strip() for v in str(value).split(";") if v.strip()]
+
+def normalize_profile(raw: Dict[str, Any]) -> Dict[str, Any]:
+    level = str(raw.get("experience_level", 1)).strip().lower()
+    return {
+        "user_id": str(raw["user_id"]),
+        "likes": _as_list(raw.get("likes")) or ["healthy"],
+        "avoid": [a.lower() for a in _as_list(raw.get("avoid"))],
+        "max_time": int(float(raw.get("max_time") or 0)),
+        "experience_level": LEVELS.get(level) or min(max(int(float(level or 1)), 1), 3),
+        "goal": str(raw.get("goal") or "stay healthy"),
+        "days": int(float(raw.get("days") or 7)),
+    }
+
+def read_profiles(path: str) -> List[Dict[str, Any]]:
+    # One bad row should not abort a whole overnight run: it is reported and skipped
+    profiles, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = enumerate(csv.DictReader(f), start=2)  # line 1 is the header
+        else:
+            rows = ((n, line) for n, line in enumerate(f, start=1) if line.strip())
+        for line_no, row in rows:
+            try:
+                raw = row if isinstance(row, dict) else json.loads(row)
+                if not isinstance(raw, dict):
+                    raise TypeError(f"expected a JSON object, got {type(raw).__name__}")
+                profiles.append(normalize_profile(raw))
+            except (ValueError, KeyError, TypeError) as e:
+                skipped += 1
+                print(f"⚠️ Skipping profile on line {line_no} of {path}: {type(e).__name__}: {e}")
+    if skipped:
+        print(f"⚠️ {skipped} malformed profiles skipped.")
+    return profiles
+
+def completed_users(output_path: str) -> set:
+    # The output file is the checkpoint: every line is one finished plan
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["user_id"])
+                except (ValueError, KeyError, TypeError):
+                    pass  # not a finished plan; that user is simply redone
+    return done
+
+def drop_partial_line(output_path: str) -> None:
+    # An interrupted run can leave half a plan at the end of the file. Appending after it would glue the
+    # next plan onto it, so the file is first cut back to its last complete line.
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        keep = 0
+        while pos > 0:
+            step = min(pos, 1 << 16)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                keep = pos - step + newline + 1
+                break
+            pos -= step
+        if keep < end:
+            f.truncate(keep)
+            print(f"Dropped an unfinished plan ({end - keep} bytes) at the end of {output_path}.")
+
+
+# ====== 2. Retrieval sub-queries ======
+def sub_queries(profile: Dict[str, Any]) -> List[str]:
+    return [like.lower() for like in profile["likes"]]
+
+def retrieve_all(profiles: List[Dict[str, Any]], k: int = CANDIDATES_PER_QUERY) -> Dict[str, List[Dict[str, Any]]]:
+    queries = [q for p in profiles for q in sub_queries(p)]
+    return kb.search_many(queries, k=k)
+
+
+# ====== 3. Meals and workouts ======
+def parse_minutes(total_time: Any) -> Optional[int]:
+    # "1 hrs 15 mins" -> 75; None when unknown
+    hours = re.search(r"(\d+)\s*hr", str(total_time))
+    mins = re.search(r"(\d+)\s*min", str(total_time))
+    if not hours and not mins:
+        return None
+    return (int(hours.group(1)) * 60 if hours else 0) + (int(mins.group(1)) if mins else 0)
+
+def pick_meals(profile: Dict[str, Any], hits_by_query: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    def allowed(hit):
+        if hit["score"] <= 0:
+            return False  # filler returned when nothing matches the liked food
+        text = hit["text"].lower()
+        if any(a in text for a in profile["avoid"]):
+            return False
+        minutes = parse_minutes(hit["total_time"])
+        return not profile["max_time"] or (minutes is not None and minutes <= profile["max_time"])
+
+    # Take the best remaining recipe from each liked food in turn, so the week mixes all of them
+    pools = [[h for h in hits_by_query.get(q, []) if allowed(h)] for q in sub_queries(profile)]
+    meals, seen = [], set()
+    while len(meals) < profile["days"] and any(pools):
+        for pool in pools:
+            while pool and pool[0]["recipe"] in seen:
+                pool.pop(0)
+            if pool and len(meals) < profile["days"]:
+                hit = pool.pop(0)
+                seen.add(hit["recipe"])
+                meals.append({"recipe": hit["recipe"], "id": hit["id"], "total_time": hit["total_time"], "url": hit["url"]})
+    return meals
+
+def plan_meals(profiles: List[Dict[str, Any]], hits_by_query: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    meals = {p["user_id"]: pick_meals(p, hits_by_query) for p in profiles}
+    # Foods to avoid and time limits can empty the first candidates; search those users' likes deeper
+    short = [p for p in profiles if len(meals[p["user_id"]]) < p["days"]]
+    if short:
+        deeper = retrieve_all(short, k=REFILL_CANDIDATES)
+        for p in short:
+            meals[p["user_id"]] = pick_meals(p, deeper)
+    return meals
+
+def load_workout_stats() -> pd.DataFrame:
+    # Average session length, weekly frequency and calories per experience level and workout type
+    gym = pd.read_csv(GYM_PATH)
+    return gym.groupby(["Experience_Level", "Workout_Type"]).agg(
+        minutes=("Session_Duration (hours)", lambda h: round(h.mean() * 60)),
+        per_week=("Workout_Frequency (days/week)", lambda d: round(d.mean())),
+        calories=("Calories_Burned", "mean"),
+    )
+
+def pick_workouts(profile: Dict[str, Any], stats: pd.DataFrame) -> List[Dict[str, Any]]:
+    level = stats.loc[profile["experience_level"]]
+    goal = profile["goal"].lower()
+    if "muscle" in goal or "strength" in goal:
+        order = ["Strength"] + [t for t in level.sort_values("calories", ascending=False).index if t != "Strength"]
+    else:
+        order = list(level.sort_values("calories", ascending=False).index)
+    sessions = min(int(level["per_week"].max()), profile["days"])
+    # Spread the sessions evenly over the week
+    days = sorted({round(i * profile["days"] / sessions) + 1 for i in range(sessions)}) if sessions else []
+    return [{"day": day, "workout": order[i % len(order)], "minutes": int(level.loc[order[i % len(order)], "minutes"])}
+            for i, day in enumerate(days)]
+
+
+# ====== 4. Plan overviews ======
+def overview_prompt(profile: Dict[str, Any], meals: List[Dict[str, Any]], workouts: List[Dict[str, Any]]) -> str:
+    meal_lines = "\n".join(f"Day {i + 1}: {m['recipe']}" for i, m in enumerate(meals))
+    workout_lines = "\n".join(f"Day {w['day']}: {w['workout']} ({w['minutes']} min)" for w in workouts)
+    return (
+        "You are a friendly health and wellness coach.\n"
+        f"Goal: {profile['goal']}. Experience level: {profile['experience_level']} of 3.\n"
+        f"Meals:\n{meal_lines}\nWorkouts:\n{workout_lines}\n"
+        "Write a short, encouraging three-sentence overview of this week's plan.\nOverview:"
+    )
+
+def write_overviews(items: List[Dict[str, Any]], profiles: List[Dict[str, Any]], generate) -> None:
+    prompts = [overview_prompt(p, item["meals"], item["workouts"]) for p, item in zip(profiles, items)]
+    for item, text in zip(items, generate(prompts, max_new_tokens=120)):
+        item["overview"] = text
+
+
+# ====== 5. Pipeline ======
+def run(profiles_path: str, output_path: str, batch_size: int = 16, use_llm: bool = True) -> Dict[str, Any]:
+    start = time.perf_counter()
+    profiles = read_profiles(profiles_path)
+    drop_partial_line(output_path)
+    done = completed_users(output_path)
+    todo = [p for p in profiles if p["user_id"] not in done]
+    print(f"{len(profiles)} profiles, {len(done)} already planned, {len(todo)} to go.")
+
+    hits_by_query = retrieve_all(todo)
+    meals = plan_meals(todo, hits_by_query)
+    n_queries = sum(len(sub_queries(p)) for p in todo)
+    n_short = sum(len(meals[p["user_id"]]) < p["days"] for p in todo)
+    print(f"Retrieval: {n_queries} sub-queries, {len(hits_by_query)} unique, "
+          f"{time.perf_counter() - start:.1f}s. {n_short} plans have fewer meals than days.")
+
+    stats = load_workout_stats()
+    generate = None
+    if use_llm:
+        import language_model as lm
+        generate = lm.hf_generate_batch
+
+    written = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for b in range(0, len(todo), batch_size):
+            batch = todo[b:b + batch_size]
+            items = [{"user_id": p["user_id"], "goal": p["goal"], "meals": meals[p["user_id"]],
+                      "missing_meals": p["days"] - len(meals[p["user_id"]]), "workouts": pick_workouts(p, stats)}
+                     for p in batch]
+            if generate is not None:
+                write_overviews(items, batch, generate)
+            for item in items:
+                out.write(json.dumps(item, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            written += len(items)
+
+            elapsed = time.perf_counter() - start
+            print(f"[{written}/{len(todo)}] {written / elapsed * 3600:,.0f} plans/hour")
+
+    elapsed = time.perf_counter() - start
+    summary = {"planned": written, "skipped": len(done), "short_of_meals": n_short, "seconds": elapsed,
+               "plans_per_hour": written / elapsed * 3600 if elapsed else 0.0}
+    print(f"\n✅ {written} plans in {elapsed:.1f}s — {summary['plans_per_hour']:,.0f} plans/hour. Saved to: {output_path}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate weekly meal and workout plans for many profiles.")
+    parser.add_argument("profiles", help="profiles file (.jsonl or .csv)")
+    parser.add_argument("output", help="plans file (.jsonl); existing plans in it are kept and skipped")
+    parser.add_argument("--batch-size", type=int, default=16, help="profiles per LLM batch and per checkpoint")
+    parser.add_argument("--no-llm", action="store_true", help="skip the generated overviews")
+    args = parser.parse_args()
+    run(args.profiles, args.output, batch_size=args.batch_size, use_llm=not args.no_llm)
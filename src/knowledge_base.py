@@ -5,14 +5,21 @@
 
 # First, let's import necessary packages
 from __future__ import annotations
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, asdict, replace
 from typing import Callable, Dict, List, Tuple, Optional, Any
-import json, math, re, textwrap, random, os, sys
+import json, math, re, textwrap, random, os, sys, threading
 import ast  # ✅ ADD THIS IMPORT
 import math
 from collections import Counter, defaultdict
+from array import array
+import heapq
+from functools import lru_cache
+from bisect import bisect_left
 import pandas as pd
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import profiling
+
     # 1. Load the dataset
 DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data")
 
@@ -53,37 +60,82 @@ if "URL" not in recipes_data.columns:
 recipes_data["URL"] = recipes_data["URL"].fillna("")
 
 # 2. Build the Corpus
-CORPUS = []
-
-# Handle missing values to prevent errors during iteration
-recipes_data['Name'] = recipes_data['Name'].fillna("Unnamed Recipe")
-recipes_data['Ingredients'] = recipes_data['Ingredients'].fillna("")
-recipes_data['Total Time'] = recipes_data.get('Total Time', 'Unknown').fillna('Unknown')
-recipes_data['URL'] = recipes_data.get('URL', '').fillna('')
+# The corpus is stored column by column instead of as one dict per recipe: at a million recipes the
+# per-object overhead of dicts (and the recipe name copied into every "text" field) adds up to gigabytes.
+# Indexing CORPUS still gives back the familiar dict, built on demand, and the searchable text is
+# only rebuilt from the raw ingredients when a snippet actually needs it.
 
-for index, row in recipes_data.iterrows():
+def ingredient_text(raw_ingredients: Any) -> str:
     # ADAPTATION: The template expects a list of dicts [{'name': 'salt'}, ...], 
     # but our current CSV has ingredients as a plain string (e.g., "1 cup flour, 2 eggs...").
     # We use the string directly if it's not a list structure.
-    raw_ingredients = row["Ingredients"]
-    
     if isinstance(raw_ingredients, str) and raw_ingredients.strip().startswith("[{"):
         try:
             ing_list = ast.literal_eval(raw_ingredients)
-            ingredient_names = " ".join([i.get("name", "") for i in ing_list])
+            return " ".join([i.get("name", "") for i in ing_list])
         except:
-            ingredient_names = raw_ingredients
-    else:
-        ingredient_names = str(raw_ingredients)
-
-    recipe_entry = {
-        "id": f"recipe{index}",
-        "recipe": row["Name"],
-        "text": f"{row['Name']} {ingredient_names}", 
-        "total_time": row["Total Time"],
-        "url": row["URL"]
-    }
-    CORPUS.append(recipe_entry)
+            return raw_ingredients
+    return str(raw_ingredients)
+
+class RecipeStore:
+    """Columnar recipe records. Row i is the i-th entry of every column."""
+    __slots__ = ("ids", "names", "total_times", "urls", "raw_ingredients", "_positions")
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.total_times: List[Any] = []
+        self.urls: List[str] = []
+        self.raw_ingredients: List[Any] = []
+        self._positions: Optional[Dict[str, int]] = None  # id -> row, built on first lookup
+
+    def append(self, doc_id: str, name: str, total_time: Any, url: str, raw_ingredients: Any) -> None:
+        self.ids.append(doc_id)
+        self.names.append(name)
+        self.total_times.append(total_time)
+        self.urls.append(url)
+        self.raw_ingredients.append(raw_ingredients)
+        if self._positions is not None:
+            self._positions[doc_id] = len(self.ids) - 1
+
+    def position(self, doc_id: str) -> Optional[int]:
+        # Latest row with this id (a removed document may be added again under the same id)
+        if self._positions is None:
+            self._positions = {d: i for i, d in enumerate(self.ids)}
+        return self._positions.get(doc_id)
+
+    def text(self, i: int) -> str:
+        return f"{self.names[i]} {ingredient_text(self.raw_ingredients[i])}"
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int | slice) -> Dict[str, Any] | List[Dict[str, Any]]:
+        if isinstance(i, slice):  # like the list of dicts the corpus used to be
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {
+            "id": self.ids[i],
+            "recipe": self.names[i],
+            "text": self.text(i),
+            "total_time": self.total_times[i],
+            "url": self.urls[i]
+        }
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+CORPUS = RecipeStore()
+
+# Handle missing values to prevent errors during iteration
+recipes_data['Name'] = recipes_data['Name'].fillna("Unnamed Recipe")
+recipes_data['Ingredients'] = recipes_data['Ingredients'].fillna("")
+recipes_data['Total Time'] = recipes_data.get('Total Time', 'Unknown').fillna('Unknown')
+recipes_data['URL'] = recipes_data.get('URL', '').fillna('')
+
+for index, name, raw_ingredients, total_time, url in zip(
+        recipes_data.index, recipes_data["Name"], recipes_data["Ingredients"],
+        recipes_data["Total Time"], recipes_data["URL"]):
+    CORPUS.append(f"recipe{index}", name, total_time, url, raw_ingredients)
 
 print(f"Knowledge Base loaded with {len(CORPUS)} documents.")
 
@@ -105,11 +157,48 @@ print(f"Knowledge Base loaded with {len(CORPUS)} documents.")
 def tokenize(text: str) -> List[str]:
     return re.findall(r"[a-zA-Z0-9']+", text.lower())
 
-#     Get all the words of each document in the corpus
-DOC_TOKENS = [tokenize(d["recipe"] + " " + d["text"]) for d in CORPUS]
+#     Every distinct word is interned once and referred to by an integer id from then on
+VOCAB: List[str] = []            # term id -> term
+VOCAB_IDS: Dict[str, int] = {}   # term -> term id
+
+#     Each word is also indexed by its character trigrams ("^ch", "chi", ..., "en$"), which lets
+#     misspelled query words be matched to vocabulary words that share most of their trigrams.
+#     Postings are split by word length ("chi7" holds the 7-letter words containing "chi"), so a lookup
+#     only reads words whose length is within reach of the misspelling.
+TRIGRAMS: Dict[str, array] = {}  # trigram + word length -> ids of the terms containing it
+
+def trigrams(term: str) -> set:
+    padded = f"^{term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def term_id(term: str) -> int:
+    tid = VOCAB_IDS.get(term)
+    if tid is None:
+        tid = len(VOCAB)
+        term = sys.intern(term)
+        VOCAB.append(term)
+        VOCAB_IDS[term] = tid
+        for g in trigrams(term):
+            TRIGRAMS.setdefault(f"{g}{len(term)}", array("I")).append(tid)
+    return tid
+
+#     Get all the words of each document in the corpus, stored back to back as term ids:
+#     document i owns DOC_TOKEN_IDS[DOC_OFFSETS[i]:DOC_OFFSETS[i + 1]]
+DOC_TOKEN_IDS = array("I")
+DOC_OFFSETS = array("Q", [0])
 
-#     Get all the words from the corpus
-VOCAB = sorted(set(t for doc in DOC_TOKENS for t in doc))
+def _append_tokens(i: int) -> None:
+    DOC_TOKEN_IDS.extend(term_id(t) for t in tokenize(CORPUS.names[i] + " " + CORPUS.text(i)))
+    DOC_OFFSETS.append(len(DOC_TOKEN_IDS))
+
+for i in range(len(CORPUS)):
+    _append_tokens(i)
+
+def doc_token_ids(i: int) -> array:
+    return DOC_TOKEN_IDS[DOC_OFFSETS[i]:DOC_OFFSETS[i + 1]]
+
+def doc_tokens(i: int) -> List[str]:
+    return [VOCAB[t] for t in doc_token_ids(i)]
 
 
 # 2.  Compute term frequency (TF) for each doc
@@ -142,21 +231,249 @@ def compute_df(doc_tokens: List[List[str]]) -> Dict[str, float]:
     # ===== TODO =====
 
 #     Compute the inverse document frequency (higher for rarer terms), in which we use a smoothed variant
-DF = compute_df(DOC_TOKENS) # Get the DF
-N_DOC = len(DOC_TOKENS) # number of docs
-IDF = {t: math.log((N_DOC + 1) / (DF[t] + 0.5)) + 1 for t in VOCAB} # Inverse document frequency
+def smoothed_idf(df: int, n_docs: int) -> float:
+    return math.log((n_docs + 1) / (df + 0.5)) + 1 # Inverse document frequency
+
+
+# 4.   The index. Rather than one dict per document, the document vectors are stored as an inverted index:
+#      term t appears in post_docs[post_offsets[t]:post_offsets[t + 1]] with the matching term frequencies
+#      in post_tf. The TF-IDF weight of a term is tf * IDF, and doc_norms holds each document vector's length.
+#
+#      Recipes can be added and removed while the app is running. Rebuilding the whole index for every
+#      change would cost time proportional to the corpus, so changes go to a small "delta" on top of the
+#      last full build (the main segment), and a background merge folds them in from time to time:
+#        - DF changes are kept as per-term adjustments; IDF is computed from the current DF when a query
+#          needs it, so it is always exact
+#        - added documents get their own postings and norms (using the IDF at the time they were added)
+#        - removed documents are skipped while searching until the next merge leaves them out of the main
+#          segment. Rows are never renumbered (ids and in-flight searches refer to them), so a removed
+#          document's record and token ids stay in CORPUS and DOC_TOKEN_IDS; merges just step over them
+#        - the main segment's norms use the IDF of the last merge and are refreshed by the next merge
+#      All of this lives in an immutable IndexSnapshot. Every change publishes a new snapshot, and a search
+#      reads SNAPSHOT once, so in-flight searches keep a consistent view.
+#
+#      The postings and norms of added documents go into containers shared by all snapshots since the last
+#      merge. They are only ever appended to, and each snapshot reads only the rows below its own n_docs.
+#      Adding a batch therefore costs time for the batch plus one copy of the DF adjustments (an entry per
+#      term changed since the last merge, at most the vocabulary), however large the delta has grown.
+
+@dataclass(frozen=True, eq=False)
+class IndexSnapshot:
+    n_docs: int                 # documents [0, n_docs) of CORPUS exist in this view...
+    n_live: int                 # ...and this many of them have not been removed
+    deleted: frozenset          # rows of removed documents
+    base_df: array              # main segment: term id -> DF as of the last merge
+    post_offsets: array
+    post_docs: array
+    post_tf: array
+    doc_norms: array
+    df_delta: Dict[int, int] = field(default_factory=dict)     # DF changes since the last merge
+    delta_postings: Dict[int, List[Tuple[int, float]]] = field(default_factory=dict)  # shared, append-only
+    delta_norms: Dict[int, float] = field(default_factory=dict)                       # shared, append-only
+    unmerged_deleted: frozenset = frozenset()  # removed since the last merge; their postings still exist
+    pending: int = 0            # documents added or removed since the last merge
+
+    def df(self, t: int) -> int:
+        base = self.base_df[t] if t < len(self.base_df) else 0
+        return base + self.df_delta.get(t, 0)
+
+    def idf(self, t: int) -> float:
+        return smoothed_idf(self.df(t), self.n_live)
+
+    def postings(self, t: int) -> List[Tuple[int, float]]:
+        out: List[Tuple[int, float]] = []
+        if t + 1 < len(self.post_offsets):
+            lo, hi = self.post_offsets[t], self.post_offsets[t + 1]
+            out = list(zip(self.post_docs[lo:hi], self.post_tf[lo:hi]))
+        added = self.delta_postings.get(t)
+        if added:
+            # Later snapshots may have appended documents beyond this one's n_docs
+            out.extend(added[:bisect_left(added, (self.n_docs,))])
+        if self.unmerged_deleted:
+            out = [p for p in out if p[0] not in self.unmerged_deleted]
+        return out
+
+    def norm(self, i: int) -> float:
+        norm = self.delta_norms.get(i)
+        return self.doc_norms[i] if norm is None else norm
+
+def _build_snapshot(n_docs: int, deleted: frozenset, n_terms: int) -> IndexSnapshot:
+    # Full build (the initial index and every merge) over documents [0, n_docs) except the removed ones
+    base_df = array("I", bytes(4 * n_terms))
+    n_live = 0
+    for i in range(n_docs):
+        if i not in deleted:
+            n_live += 1
+            for t in set(doc_token_ids(i)):
+                base_df[t] += 1
+    idf = array("d", (smoothed_idf(df, n_live) for df in base_df))
+
+    post_offsets = array("Q", [0])
+    for df in base_df:
+        post_offsets.append(post_offsets[-1] + df)
+    post_docs = array("I", bytes(4 * post_offsets[-1]))
+    post_tf = array("f", bytes(4 * post_offsets[-1]))
+    doc_norms = array("d", bytes(8 * n_docs))  # removed documents keep a zero norm
+
+    cursor = array("Q", post_offsets[:-1])
+    for i in range(n_docs):
+        if i in deleted:
+            continue
+        ids = doc_token_ids(i)
+        sq = 0.0
+        for t, c in Counter(ids).items():
+            tf = c / len(ids)
+            pos = cursor[t]
+            post_docs[pos] = i
+            post_tf[pos] = tf
+            cursor[t] += 1
+            sq += (tf * idf[t]) ** 2
+        doc_norms[i] = math.sqrt(sq)
+    return IndexSnapshot(n_docs, n_live, frozenset(deleted), base_df, post_offsets, post_docs, post_tf, doc_norms)
+
+def _with_added(snap: IndexSnapshot, docs: range) -> IndexSnapshot:
+    # Appends to the shared delta containers; only the returned snapshot (and later ones) can see the rows
+    df_delta = dict(snap.df_delta)
+    tfs = []
+    for i in docs:
+        ids = doc_token_ids(i)
+        doc_tf = {t: c / len(ids) for t, c in Counter(ids).items()}
+        for t, tf in doc_tf.items():
+            df_delta[t] = df_delta.get(t, 0) + 1
+            snap.delta_postings.setdefault(t, []).append((i, tf))
+        tfs.append((i, doc_tf))
+    new = replace(snap, n_docs=max(snap.n_docs, docs.stop), n_live=snap.n_live + len(docs),
+                  df_delta=df_delta, pending=snap.pending + len(docs))
+    for i, doc_tf in tfs:
+        new.delta_norms[i] = math.sqrt(sum((tf * new.idf(t)) ** 2 for t, tf in doc_tf.items()))
+    return new
+
+def _with_removed(snap: IndexSnapshot, docs: frozenset) -> IndexSnapshot:
+    df_delta = dict(snap.df_delta)
+    for i in docs:
+        for t in set(doc_token_ids(i)):
+            df_delta[t] = df_delta.get(t, 0) - 1
+    return replace(snap, n_live=snap.n_live - len(docs), deleted=snap.deleted | docs,
+                   unmerged_deleted=snap.unmerged_deleted | docs, df_delta=df_delta,
+                   pending=snap.pending + len(docs))
+
+SNAPSHOT = _build_snapshot(len(CORPUS), frozenset(), len(VOCAB))
+
+
+# 4b.  Adding and removing documents
+MERGE_MIN_DOCS = 1000     # merge once this many documents changed...
+MERGE_FRACTION = 0.1      # ...and they are at least this fraction of the corpus
+
+_write_lock = threading.Lock()   # one writer at a time; searches never take it
+_merge_lock = threading.Lock()   # one merge at a time
+_ops_during_merge: Optional[List[Tuple[str, Any]]] = None
+
+def _publish(snap: IndexSnapshot, op: Tuple[str, Any]) -> None:
+    global SNAPSHOT
+    SNAPSHOT = snap
+    if _ops_during_merge is not None:
+        _ops_during_merge.append(op)  # replayed on top of the merged index
+
+def add_documents(records: List[Dict[str, Any]]) -> List[str]:
+    """Index new recipes, given as dicts with "recipe", "ingredients", and optionally "id",
+    "total_time" and "url". Returns the ids of the added documents."""
+    with _write_lock:
+        batch_ids = [str(r["id"]) if r.get("id") else None for r in records]
+        named = [d for d in batch_ids if d is not None]
+        if len(set(named)) != len(named):
+            raise ValueError("Duplicate ids in the batch of documents to add")
+        for doc_id in named:
+            pos = CORPUS.position(doc_id)
+            if pos is not None and pos not in SNAPSHOT.deleted:
+                raise ValueError(f"Document {doc_id!r} already exists")
+        # Records without an id get the next free "recipe<N>", skipping any id already taken, including
+        # explicit ids in this batch
+        taken = set(named)
+        n = len(CORPUS)
+        for j, doc_id in enumerate(batch_ids):
+            if doc_id is None:
+                while f"recipe{n}" in taken or CORPUS.position(f"recipe{n}") is not None:
+                    n += 1
+                batch_ids[j] = f"recipe{n}"
+                taken.add(batch_ids[j])
+
+        start = len(CORPUS)
+        for r, doc_id in zip(records, batch_ids):
+            CORPUS.append(doc_id, r.get("recipe") or "Unnamed Recipe",
+                          r.get("total_time") or "Unknown", r.get("url") or "", r.get("ingredients") or "")
+            _append_tokens(len(CORPUS) - 1)
+        docs = range(start, len(CORPUS))
+        _publish(_with_added(SNAPSHOT, docs), ("add", docs))
+    correct_term.cache_clear()  # new words may now be exact matches
+    _maybe_merge()
+    return CORPUS.ids[start:start + len(docs)]
+
+def remove_documents(doc_ids: List[str]) -> int:
+    """Remove recipes by id; unknown or already removed ids are ignored. Returns how many were removed."""
+    with _write_lock:
+        docs = frozenset(pos for pos in (CORPUS.position(d) for d in doc_ids)
+                         if pos is not None and pos not in SNAPSHOT.deleted)
+        if docs:
+            _publish(_with_removed(SNAPSHOT, docs), ("remove", docs))
+    if docs:
+        correct_term.cache_clear()  # a cached correction may point to a word no live document has
+    _maybe_merge()
+    return len(docs)
+
+def merge(background: bool = True) -> bool:
+    """Rebuild the main segment from all live documents, folding in the delta and refreshing every
+    norm with current IDF. Searches continue on the previous snapshot meanwhile. Returns False
+    if a merge is already running."""
+    if not _merge_lock.acquire(blocking=False):
+        return False
+
+    def work():
+        global SNAPSHOT, _ops_during_merge
+        try:
+            with _write_lock:
+                base = SNAPSHOT
+                n_terms = len(VOCAB)
+                _ops_during_merge = []
+            merged = _build_snapshot(base.n_docs, base.deleted, n_terms)
+            with _write_lock:
+                # Changes that arrived while we were rebuilding go on top, as a fresh delta
+                for op, docs in _ops_during_merge:
+                    merged = _with_added(merged, docs) if op == "add" else _with_removed(merged, docs)
+                SNAPSHOT = merged
+        finally:
+            with _write_lock:
+                _ops_during_merge = None
+            _merge_lock.release()
+        _maybe_merge()  # the changes replayed above may already call for the next merge
+
+    if background:
+        threading.Thread(target=work, name="index-merge", daemon=True).start()
+    else:
+        work()
+    return True
 
+def _maybe_merge() -> None:
+    snap = SNAPSHOT
+    if snap.pending >= max(MERGE_MIN_DOCS, MERGE_FRACTION * snap.n_live):
+        merge(background=True)
 
 
-# 4.   We compute TF-IDF vectors for each document, which is the product between
-def tfidf_vector(tokens: List[str]) -> Dict[str, float]:
+# 4c.  TF-IDF vectors for queries, keyed by term id. Words outside the vocabulary have no IDF and are dropped.
+def tfidf_vector(tokens: List[str], snap: Optional[IndexSnapshot] = None) -> Dict[int, float]:
     # Input: A list of words in a document
-    # Output: A dictionary of tf-idf score of each word
+    # Output: A dictionary of tf-idf score of each known word id
+    snap = snap or SNAPSHOT
     tf = compute_tf(tokens)
-    vec = {t: tf[t] * IDF.get(t, 0.0) for t in tf}
+    vec = {}
+    for t, f in tf.items():
+        tid = VOCAB_IDS.get(t)
+        if tid is not None and snap.df(tid) > 0:
+            vec[tid] = f * snap.idf(tid)
     return vec
 
-DOC_VECS = [tfidf_vector(tokens) for tokens in DOC_TOKENS]
+def doc_vector(i: int) -> Dict[str, float]:
+    # Rebuild the TF-IDF dictionary of one document, e.g. for inspection
+    return {VOCAB[t]: w for t, w in tfidf_vector(doc_tokens(i)).items()}
 
 
 # 5.   We compute the cosine similarity for the search
@@ -182,23 +499,158 @@ def cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
     # ===== TODO =====
 
 
-# 6.   We implement a search method based on the cosine similarity, which finds the documents with the highest similarity scores as the top-k search results.
-def search_corpus(query: str, k: int = 3) -> List[Dict[str, Any]]:
-    qvec = tfidf_vector(tokenize(query))
-    scored = [(cosine(qvec, v), i) for i, v in enumerate(DOC_VECS)]
-    scored.sort(reverse=True)
+# 6.   Before scoring, query words missing from the vocabulary ("chiken", "ricee") are mapped to the
+#      closest vocabulary word. Candidates come from the trigram index: words whose length already rules
+#      them out are dropped, and the rest are ranked by the Dice overlap of their trigram sets, so long words
+#      that merely contain many of the query's trigrams ("riceeflour...") cannot crowd the real match out.
+#      The best candidate within a small edit distance wins; ties go to the more common word.
+MIN_CORRECTION_LEN = 5    # shorter unknown words are usually stop words, not typos
+FUZZY_CANDIDATES = 64     # trigram-overlap candidates checked with the edit distance
+
+#      Ordinary English words that are simply absent from the recipes are not typos, and "correcting" them
+#      changes the query ("around" -> "ground" pulls in ground-meat recipes). This covers function words and
+#      the words of typical requests, such as the app's "...should take around 30 minutes or less".
+COMMON_WORDS = frozenset("""
+    about above across after afterwards again against almost alone along already although always among
+    another anyone anything anywhere around because become before behind being below beside besides
+    between beyond cannot could doing during either enough especially every everyone everything except
+    further getting given going gonna having hello hence however instead itself likely looking maybe
+    might minute minutes hours second seconds moreover mostly myself neither never nothing often other
+    others otherwise ourselves perhaps please quite rather really recipe recipes should since something
+    sometimes somewhere still suggest suggestion thank thanks their theirs themselves there therefore
+    these thing things think those though through throughout today tomorrow tonight toward towards under
+    unless until using usually various wanna wants whatever whenever where whereas wherever whether
+    which while whose within without would yourself yourselves meals dishes ideas options cooking cooked
+    making takes taking quick quickly simple simply healthy tasty delicious favorite favourite
+    ingredient ingredients minimum maximum least""".split())
+
+def edit_distance(a: str, b: str, bound: int) -> int:
+    # Levenshtein distance counting a swap of two neighbouring letters as one edit;
+    # returns bound + 1 as soon as the distance is known to exceed bound
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > bound:
+            return bound + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+@lru_cache(maxsize=65536)
+def correct_term(term: str) -> Optional[str]:
+    if term in VOCAB_IDS or term in COMMON_WORDS or len(term) < MIN_CORRECTION_LEN or not term.isalpha():
+        return None
+    max_edits = 1 if len(term) <= 6 else 2
+    grams = trigrams(term)
+    # A word of n letters has (at most) n padded trigrams, which stands in for its trigram set size
+    scored = []
+    for n in range(len(term) - max_edits, len(term) + max_edits + 1):
+        shared = Counter()
+        for g in grams:
+            postings = TRIGRAMS.get(f"{g}{n}")
+            if postings is not None:
+                shared.update(postings)
+        scored.extend((2 * overlap / (len(grams) + n), tid) for tid, overlap in shared.items())
+    best = None
+    snap = SNAPSHOT
+    for dice, tid in heapq.nlargest(FUZZY_CANDIDATES, scored):
+        df = snap.df(tid)
+        if df <= 0:
+            continue  # only found in removed documents
+        candidate = VOCAB[tid]
+        dist = edit_distance(term, candidate, max_edits)
+        if dist <= max_edits:
+            key = (dist, -df, -dice)
+            if best is None or key < best[0]:
+                best = (key, candidate)
+    return best[1] if best else None
+
+def correct_tokens(tokens: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    corrected, corrections = [], {}
+    for t in tokens:
+        fixed = correct_term(t)
+        if fixed is not None:
+            corrections[t] = fixed
+        corrected.append(fixed or t)
+    return corrected, corrections
+
+def query_words(query: str) -> List[str]:
+    # The words search_corpus actually looks up for a query, after spelling correction
+    return correct_tokens(tokenize(query))[0]
+
+
+# 7.   We implement a search method based on the cosine similarity, which finds the documents with the highest similarity scores as the top-k search results.
+#      Only documents sharing at least one word with the query are scored, by walking the query terms' postings.
+def _rank(tokens: List[str], k: int, snap: IndexSnapshot,
+          postings_cache: Optional[Dict[int, Any]] = None) -> List[Tuple[float, int]]:
+    qvec = tfidf_vector(tokens, snap)
+    qnorm = math.sqrt(sum(v*v for v in qvec.values()))
+    dots: Dict[int, float] = defaultdict(float)
+    for t, qw in qvec.items():
+        w = qw * snap.idf(t)
+        postings = postings_cache.get(t) if postings_cache is not None else None
+        if postings is None:
+            postings = snap.postings(t)
+            if postings_cache is not None:
+                postings_cache[t] = postings
+        for i, tf in postings:
+            dots[i] += w * tf
+    scored = heapq.nlargest(k, ((dot / (qnorm * snap.norm(i) + 1e-12), i) for i, dot in dots.items()))
+    # Like a full scan, fill up with zero-score documents when fewer than k share a word with the query
+    i = snap.n_docs - 1
+    while len(scored) < k and i >= 0:
+        if i not in dots and i not in snap.deleted:
+            scored.append((0.0, i))
+        i -= 1
+    return scored
+
+def search_corpus(query: str, k: int = 3, fuzzy: bool = True) -> List[Dict[str, Any]]:
+    snap = SNAPSHOT
+    tokens = tokenize(query)
+    if fuzzy:
+        tokens, _ = correct_tokens(tokens)
     results = []
-    for score, idx in scored[:k]:
-        d = CORPUS[idx].copy()
+    for score, idx in _rank(tokens, k, snap):
+        d = CORPUS[idx]
         d["score"] = float(score)
         results.append(d)
     return results
 
+#      For offline jobs with many queries: repeated queries are searched once, each term's postings are
+#      decoded once for the whole batch, and each hit document's record is built once.
+def search_many(queries: List[str], k: int = 3, fuzzy: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+    snap = SNAPSHOT
+    postings_cache: Dict[int, Any] = {}
+    records: Dict[int, Dict[str, Any]] = {}
+    results = {}
+    for query in dict.fromkeys(queries):
+        tokens = tokenize(query)
+        if fuzzy:
+            tokens, _ = correct_tokens(tokens)
+        hits = []
+        for score, idx in _rank(tokens, k, snap, postings_cache):
+            if idx not in records:
+                records[idx] = CORPUS[idx]
+            d = dict(records[idx])
+            d["score"] = float(score)
+            hits.append(d)
+        results[query] = hits
+    return results
+
 #       Integrate the search method as a tool
+@profiling.profile_span("tool_search")
 def tool_search(query: str, k: int = 3) -> Dict[str, Any]:
     hits = search_corpus(query, k=k)
+    _, corrections = correct_tokens(tokenize(query))
     # Return a concise, citation-friendly payload
-    return {
+    payload = {
         "tool": "search",
         "query": query,
         "results": [
@@ -211,6 +663,10 @@ def tool_search(query: str, k: int = 3) -> Dict[str, Any]:
             for h in hits
         ],
     }
+    # Tell the agent which words were read as something else, so it does not need to refine the spelling
+    if corrections:
+        payload["corrections"] = corrections
+    return payload
 
 TOOLS = {
     "search": {
@@ -221,4 +677,86 @@ TOOLS = {
         "schema": {"answer": "str"},
         "fn": lambda answer: {"tool": "finish", "answer": answer}
     }
-}
\ No newline at end of file
+}
+
+
+# 8.   Memory report: bytes per document of the original dict/list layout versus the compact one above
+def _deep_size(obj: Any, seen: set) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(x, seen) for x in obj)
+    elif isinstance(obj, RecipeStore):
+        size += sum(_deep_size(getattr(obj, name), seen) for name in RecipeStore.__slots__)
+    return size
+
+def index_bytes(fuzzy: bool = True, seen: Optional[set] = None) -> int:
+    # Resident size of the search index (everything but the recipe records); the trigram index is
+    # only needed for spelling correction
+    snap = SNAPSHOT
+    seen = set() if seen is None else seen
+    parts = [VOCAB, VOCAB_IDS, DOC_TOKEN_IDS, DOC_OFFSETS, snap.base_df, snap.post_offsets, snap.post_docs,
+             snap.post_tf, snap.doc_norms, snap.df_delta, snap.delta_postings, snap.delta_norms]
+    if fuzzy:
+        parts.append(TRIGRAMS)
+    return sum(_deep_size(obj, seen) for obj in parts)
+
+def memory_report(sample: int = 500) -> Dict[str, float]:
+    snap = SNAPSHOT
+    n = max(snap.n_live, 1)
+    # Original layout, rebuilt for a sample of documents and extrapolated per document
+    picked = random.Random(0).sample(range(snap.n_docs), min(sample, snap.n_docs))
+    legacy = []  # keep everything alive so object ids are not reused while measuring
+    for i in picked:
+        record = CORPUS[i]
+        tokens = tokenize(record["recipe"] + " " + record["text"])
+        vec = {t: f * snap.idf(VOCAB_IDS[t]) for t, f in compute_tf(tokens).items()}
+        legacy.append((record, tokens, vec))
+    seen: set = set()
+    legacy_docs = sum(_deep_size(obj, seen) for doc in legacy for obj in doc)
+    legacy_vocab = [sorted(VOCAB), {t: snap.df(i) for i, t in enumerate(VOCAB)}, {t: snap.idf(i) for i, t in enumerate(VOCAB)}]
+    legacy_terms = sum(_deep_size(obj, seen) for obj in legacy_vocab)
+    before = legacy_docs / max(len(picked), 1) + legacy_terms / n
+
+    # Compact layout, measured in full
+    seen = set()
+    after = (_deep_size(CORPUS, seen) + index_bytes(seen=seen)) / n
+    return {"documents": snap.n_live, "bytes_per_doc_before": before, "bytes_per_doc_after": after,
+            "reduction": 1 - after / before if before else 0.0}
+
+# 9.   Corpus statistics in their original form (DF, IDF, DOC_TOKENS, DOC_VECS, N_DOC), as used by the
+#      course notebook. They are built from the current index on each access rather than kept in memory.
+def __getattr__(name: str) -> Any:
+    snap = SNAPSHOT
+    live = [i for i in range(snap.n_docs) if i not in snap.deleted]
+    if name == "N_DOC":
+        return snap.n_live
+    if name == "DF":
+        return {VOCAB[t]: snap.df(t) for t in range(len(VOCAB)) if snap.df(t) > 0}
+    if name == "IDF":
+        return {VOCAB[t]: snap.idf(t) for t in range(len(VOCAB)) if snap.df(t) > 0}
+    if name == "DOC_TOKENS":
+        return [doc_tokens(i) for i in live]
+    if name == "DOC_VECS":
+        return [doc_vector(i) for i in live]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+if __name__ == "__main__":
+    report = memory_report()
+    print(f"Bytes per document: {report['bytes_per_doc_before']:,.0f} before, "
+          f"{report['bytes_per_doc_after']:,.0f} after ({report['reduction']:.0%} smaller)")
+
+    # Spelling correction must leave the wording of the app's queries (see app.py) alone and only fix
+    # real typos in the ingredients
+    for ingredients, typo in [("chicken", None), ("beef", None), ("eggs", None), ("spinach", None),
+                              ("chiken, ricee", {"chiken": "chicken", "ricee": "rice"})]:
+        query = f"What can I make using {ingredients}? The recipe should take around 30 minutes or less."
+        _, corrections = correct_tokens(tokenize(query))
+        assert corrections == (typo or {}), f"{query!r}: unexpected corrections {corrections}"
+        if typo is None:
+            assert [h["id"] for h in search_corpus(query)] == [h["id"] for h in search_corpus(query, fuzzy=False)]
+    print("Spelling correction leaves the app's query template alone.")
@@ -1,41 +1,123 @@
 # 1. We will load a language model model from huggingface (Qwen 0.5B Instruct)
-import re, torch
+#    Loading takes a while, so it happens on a background thread: importing this module returns at once,
+#    HANDLE reports how far loading got, and hf_llm() waits for the model only when it is first needed.
+import os, re, sys, threading, time, torch
+from typing import List
 from transformers import AutoModelForCausalLM, AutoTokenizer, GenerationConfig
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import profiling
+
 MODEL_NAME   = "Qwen/Qwen2.5-0.5B-Instruct"    # swap if you prefer another instruct model
 LOAD_8BIT    = False                           # set True if you installed bitsandbytes and want 8-bit loading
 DTYPE        = torch.bfloat16 if torch.cuda.is_available() else torch.float32
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
-
 # ====== TODO ======
 # Load model with AutoModelForCausalLM.from_pretrained() from huggingface with the above MODEL_NAME, LOAD_8BIT, DTYPE
-try:
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
-        load_in_8bit=LOAD_8BIT,
-        torch_dtype=DTYPE,
-        device_map="auto", # Automatically places model on GPU if available
-        trust_remote_code=True
-    )
-except Exception as e:
-    print(f"Error loading model with device_map='auto': {e}")
-    print("Falling back to CPU/Standard load...")
-    model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, trust_remote_code=True)
-    if torch.cuda.is_available():
-        model.to("cuda")
+# low_cpu_mem_usage skips the throwaway randomly initialised copy of the weights, and safetensors
+# checkpoints are memory-mapped instead of read into a second buffer.
+def load_model():
+    try:
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_NAME,
+            load_in_8bit=LOAD_8BIT,
+            torch_dtype=DTYPE,
+            device_map="auto", # Automatically places model on GPU if available
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+            trust_remote_code=True
+        )
+    except Exception as e:
+        print(f"Error loading model with device_map='auto': {e}")
+        print("Falling back to CPU/Standard load...")
+        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, low_cpu_mem_usage=True, trust_remote_code=True)
+        if torch.cuda.is_available():
+            model.to("cuda")
+    model.eval()
+    return model
 
 # Generation configuration: use GenerationConfig to define the generation parameters
-gen_cfg = GenerationConfig(
-    max_new_tokens=200,
-    do_sample=True,
-    temperature=0.01,
-    top_p=0.9,
-    repetition_penalty=1.1,
-    pad_token_id=tokenizer.eos_token_id
-)
+def make_generation_config(tokenizer) -> GenerationConfig:
+    return GenerationConfig(
+        max_new_tokens=200,
+        do_sample=True,
+        temperature=0.01,
+        top_p=0.9,
+        repetition_penalty=1.1,
+        pad_token_id=tokenizer.eos_token_id
+    )
 # ====== TODO ======
 
+WARMUP_PROMPT = "User Question: What can I make with apples?\nNext step:\nThought:"
+
+class ModelHandle:
+    """Loads the tokenizer and model on a background thread, then runs a short warm-up generation
+    so the first real request does not pay for one-time kernel and allocator setup."""
+
+    def __init__(self, warmup_tokens: int = 8):
+        self.warmup_tokens = warmup_tokens
+        self.status = "not started"   # -> loading -> warming up -> ready (or failed)
+        self.error: Exception | None = None
+        self.load_seconds: float | None = None
+        self.tokenizer = None
+        self.model = None
+        self.gen_cfg = None
+        self._done = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> "ModelHandle":
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        try:
+            self.status = "loading"
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
+            # Batched prompts are padded on the left so every completion starts right after its prompt
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            model = load_model()
+            gen_cfg = make_generation_config(tokenizer)
+
+            self.status = "warming up"
+            with torch.inference_mode():
+                inputs = tokenizer(WARMUP_PROMPT, return_tensors="pt").to(model.device)
+                model.generate(**inputs, generation_config=gen_cfg, max_new_tokens=self.warmup_tokens)
+
+            self.tokenizer, self.model, self.gen_cfg = tokenizer, model, gen_cfg
+            self.status = "ready"
+        except Exception as e:
+            self.error = e
+            self.status = "failed"
+            print(f"Error loading language model: {e}")
+        finally:
+            self.load_seconds = time.perf_counter() - started
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until loading finished (or timeout); raises if loading failed."""
+        self.start()
+        finished = self._done.wait(timeout)
+        if self.error is not None:
+            raise RuntimeError(f"Language model failed to load: {self.error}") from self.error
+        return finished
+
+    def get(self):
+        self.wait()
+        return self.tokenizer, self.model, self.gen_cfg
+
+HANDLE = ModelHandle().start()
+
 # ====== Helper function: Enforce two-line schema in the decoding ======
 T_PATTERN = re.compile(r"Thought:\s*(.+)")
 A_PATTERN = re.compile(r"Action:\s*(.+)")
@@ -78,10 +160,13 @@ def _postprocess_to_two_lines(text: str) -> str:
 
 
 # 2. We define the LLM function. This will be plugged into the agent without changing the controller ---
-def hf_llm(prompt: str) -> str:
+@profiling.profile_span("hf_llm")
+def hf_llm(prompt: str, max_new_tokens: int | None = None, max_time: float | None = None) -> str:
     """
     Completes from your existing ReAct prompt and returns exactly two lines:
     'Thought: ...' and 'Action: ...'
+    max_new_tokens / max_time optionally tighten the generation limits (used by deadline-aware runs);
+    generation stops after max_time seconds even mid-sentence.
     """
     # We add a strong instruction to the prompt to improve compliance with the format
     format_guard = (
@@ -96,9 +181,20 @@ def hf_llm(prompt: str) -> str:
     #     Here, let's write the code to use language model to generate the response given the full_prompt
     #     First, we need to use the tokenizer to tokenize the prompt into pytorch tensors
     #     Second, we need to use model.generate() to generate the model response (which includes the Thought and Action)
+    started = time.perf_counter()
+    if max_time is not None and not HANDLE.wait(timeout=max_time):
+        return _postprocess_to_two_lines("")  # the model is still loading and this step's time is up
+    tokenizer, model, gen_cfg = HANDLE.get()
     device = model.device
     inputs = tokenizer(full_prompt, return_tensors="pt").to(device)
-    output_ids = model.generate(**inputs, generation_config=gen_cfg)
+    limits = {}
+    if max_new_tokens is not None:
+        limits["max_new_tokens"] = max_new_tokens
+    if max_time is not None:
+        # max_time counts from the start of the step; waiting for the model and tokenizing used part of it
+        limits["max_time"] = max(0.0, max_time - (time.perf_counter() - started))
+    with torch.inference_mode(), profiling.torch_ops("hf_llm.generate"):
+        output_ids = model.generate(**inputs, generation_config=gen_cfg, **limits)
     # ====== TODO ======
 
 
@@ -107,5 +203,15 @@ def hf_llm(prompt: str) -> str:
 
     return _postprocess_to_two_lines(completion)
 
+# Offline jobs (e.g. batch_plans.py) generate free-form text for many prompts at once: one padded
+# batch per call keeps the CPU busy with large matrix products instead of many small ones.
+def hf_generate_batch(prompts: List[str], max_new_tokens: int = 200) -> List[str]:
+    tokenizer, model, gen_cfg = HANDLE.get()
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    with torch.inference_mode():
+        output_ids = model.generate(**inputs, generation_config=gen_cfg, max_new_tokens=max_new_tokens)
+    prompt_len = inputs["input_ids"].shape[1]
+    return [tokenizer.decode(ids[prompt_len:], skip_special_tokens=True).strip() for ids in output_ids]
+
 # We will wire it into the agent system
 LLM = hf_llm
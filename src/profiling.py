@@ -0,0 +1,202 @@
+# Opt-in profiling of live requests
+# A configurable fraction of requests is profiled while serving real traffic, with no debugger attached:
+#   - a sampling profiler thread records the request thread's Python stack every few milliseconds
+#     (tokenization, model.generate, json.dumps of observations, pandas work, ...)
+#   - spans time the wrapped entry points (hf_llm, tool_search, ...)
+#   - generation runs under torch.profiler, recording operator-level CPU timings
+# Each profiled request writes <stamp>_<name>.folded (collapsed stacks, the input format of
+# flamegraph.pl / speedscope), .svg (a flame graph), .spans.json and, if generation ran, .torch_ops.txt.
+#
+# Enable with environment variables (profiling is off by default):
+#     AGENT_PROFILE_RATE=0.05          profile 5% of requests
+#     AGENT_PROFILE_INTERVAL_MS=5      stack sampling interval
+#     AGENT_PROFILE_DIR=results/profiles
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+import itertools
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from html import escape
+from typing import Any, Callable, Dict, List, Optional
+
+PROFILE_RATE = float(os.environ.get("AGENT_PROFILE_RATE", "0"))
+SAMPLE_INTERVAL = float(os.environ.get("AGENT_PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR = os.environ.get("AGENT_PROFILE_DIR", os.path.join("results", "profiles"))
+
+_local = threading.local()           # .profile: the RequestProfile active on this thread, if any
+_torch_lock = threading.Lock()       # torch.profiler supports one active session per process
+_counter = itertools.count(1)
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, target_thread_id: int, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, name: str, interval: float = SAMPLE_INTERVAL, out_dir: str = PROFILE_DIR):
+        self.name = name
+        self.out_dir = out_dir
+        self.sampler = StackSampler(threading.get_ident(), interval)
+        self.spans: List[Dict[str, Any]] = []
+        self.torch_tables: List[str] = []
+        self.started = 0.0
+
+    def __enter__(self) -> "RequestProfile":
+        _local.profile = self
+        self.started = time.perf_counter()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sampler.stop()
+        _local.profile = None
+        self.spans.append({"name": self.name, "seconds": time.perf_counter() - self.started})
+        # A profile is a by-product of the request; a full or read-only disk must not fail the request
+        try:
+            self.write()
+        except OSError as e:
+            print(f"[profiling] could not write the {self.name} profile to {self.out_dir}: {e}", file=sys.stderr)
+
+    def write(self) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.out_dir, f"{stamp}_{self.name.replace('.', '_')}_{next(_counter)}")
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(base + ".svg", "w", encoding="utf-8") as f:
+            f.write(flame_graph_svg(self.sampler.stacks, title=f"{self.name} ({sum(self.sampler.stacks.values())} samples)"))
+        with open(base + ".spans.json", "w", encoding="utf-8") as f:
+            json.dump(self.spans, f, indent=2)
+        if self.torch_tables:
+            with open(base + ".torch_ops.txt", "w", encoding="utf-8") as f:
+                f.write("\n\n".join(self.torch_tables))
+        return base
+
+
+def active_profile() -> Optional[RequestProfile]:
+    return getattr(_local, "profile", None)
+
+@contextmanager
+def sampled_profile(name: str, rate: Optional[float] = None):
+    """Profile the enclosed block for a `rate` fraction of calls (AGENT_PROFILE_RATE by default).
+    Nested inside an already profiled block on the same thread, it does nothing."""
+    rate = PROFILE_RATE if rate is None else rate
+    if active_profile() is not None or rate <= 0 or random.random() >= rate:
+        yield None
+        return
+    with RequestProfile(name) as profile:
+        yield profile
+
+def profile_request(name: str) -> Callable:
+    """Decorator: treat each call as one request that may be sampled for profiling."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with sampled_profile(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def profile_span(name: str) -> Callable:
+    """Decorator: time each call when it happens inside a profiled request."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = active_profile()
+            if profile is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.spans.append({"name": name, "seconds": time.perf_counter() - start})
+        return wrapper
+    return decorate
+
+@contextmanager
+def torch_ops(label: str):
+    """Record torch operator timings for the enclosed block when inside a profiled request."""
+    profile = active_profile()
+    if profile is None or not _torch_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        import torch
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as prof:
+            yield
+        table = prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=30)
+        profile.torch_tables.append(f"== {label} ==\n{table}")
+    finally:
+        _torch_lock.release()
+
+
+# ====== Flame graph ======
+def flame_graph_svg(stacks: Counter, title: str = "", width: int = 1200, row_height: int = 16) -> str:
+    # Build the call tree: every node counts the samples of all stacks passing through it
+    root: Dict[str, Any] = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["count"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+
+    def depth(node) -> int:
+        return 1 + max((depth(c) for c in node["children"].values()), default=0)
+
+    total = max(root["count"], 1)
+    rows = depth(root) - 1
+    height = (rows + 2) * row_height
+    rects = []
+
+    def draw(node, x: float, level: int) -> None:
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] / total * width
+            if w >= 0.5:
+                y = height - (level + 1) * row_height
+                hue = 20 + (hash(name) % 40)
+                label = escape(name) if w > 7 * len(name) else ""
+                rects.append(
+                    f'<g><title>{escape(name)} — {child["count"]} samples ({child["count"] / total:.1%})</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},90%,60%)"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + row_height - 4}" font-size="11">{label}</text></g>'
+                )
+                draw(child, x, level + 1)
+            x += w
+
+    draw(root, 0.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace">'
+        f'<text x="4" y="{row_height - 4}" font-size="12">{escape(title)}</text>'
+        + "".join(rects) + "</svg>\n"
+    )
@@ -0,0 +1,208 @@
+# Retrieval benchmark: answer quality versus latency for search_corpus-compatible backends
+# Labeled queries are generated from the corpus itself, so no hand-made ground truth is needed:
+#   - title_fragment:  a contiguous run of words from a recipe title     ("chocolate chip")
+#   - ingredients:     a few of one recipe's ingredient names, preferring rare ones ("buttermilk nutmeg pecans")
+#   - perturbed_title: the title with one or two typos                    ("banan bread")
+# A query's relevant documents are the recipe it came from plus any recipe with the same title.
+# Any function with the signature search(query, k) -> [{"id": ...}, ...] can be scored. Next to the
+# per-query numbers, each backend reports the resident size of its index (INDEX_SIZE), which is what
+# matters when comparing index layouts or approximate-nearest-neighbour backends.
+
+import os
+import sys
+import json
+import math
+import random
+import re
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import knowledge_base as kb
+
+SearchFn = Callable[..., List[Dict[str, Any]]]
+
+BACKENDS: Dict[str, SearchFn] = {
+    "tfidf_exact": lambda query, k=3: kb.search_corpus(query, k=k, fuzzy=False),
+    "tfidf_fuzzy": kb.search_corpus,
+}
+
+INDEX_SIZE: Dict[str, Callable[[], int]] = {
+    "tfidf_exact": lambda: kb.index_bytes(fuzzy=False),
+    "tfidf_fuzzy": kb.index_bytes,
+}
+
+# Words in ingredient lists that do not name an ingredient
+INGREDIENT_NOISE = {
+    "cup", "cups", "tablespoon", "tablespoons", "teaspoon", "teaspoons", "ounce", "ounces", "pound",
+    "pounds", "pint", "pints", "quart", "quarts", "gallon", "inch", "inches", "pinch", "dash", "package",
+    "packages", "can", "cans", "jar", "bottle", "slice", "slices", "piece", "pieces", "sprig", "sprigs",
+    "clove", "cloves", "stick", "sticks", "head", "bunch", "container", "envelope", "wedges", "chopped",
+    "sliced", "diced", "minced", "grated", "shredded", "crushed", "peeled", "cored", "halved", "quartered",
+    "cubed", "beaten", "melted", "softened", "divided", "drained", "rinsed", "thawed", "cooked", "trimmed",
+    "needed", "taste", "optional", "large", "medium", "small", "fresh", "freshly", "finely", "thinly",
+    "coarsely", "lightly", "roughly", "about", "into", "with", "from", "more", "plus", "each", "such",
+    "other", "cold", "warm", "room", "temperature", "whole", "ground", "thick",
+}
+
+
+# ====== Query generation ======
+def _perturb(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    edit = rng.choice(("swap", "drop", "replace"))
+    if edit == "swap":
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if edit == "drop":
+        return word[:i] + word[i + 1:]
+    return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i + 1:]
+
+def _ingredient_names(raw_ingredients: Any) -> List[str]:
+    # "2 pounds Granny Smith apples (or other firm apples), peeled, cored" -> ["apples"]: the last word of
+    # each item that starts with an amount; the preparation notes between the commas have none
+    if isinstance(raw_ingredients, str) and raw_ingredients.strip().startswith("[{"):
+        items = kb.ingredient_text(raw_ingredients).split()  # already bare names
+    else:
+        items = [item for item in re.sub(r"\([^)]*\)", "", str(raw_ingredients)).split(",")
+                 if item.strip()[:1].isdigit() or item.strip()[:1] in "½¼¾⅓⅔⅛"]
+    names = []
+    for item in items:
+        words = kb.tokenize(item)
+        if words and words[-1].isalpha() and len(words[-1]) > 3 and words[-1] not in INGREDIENT_NOISE:
+            names.append(words[-1])
+    return names
+
+def generate_queries(n_per_kind: int = 200, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    snap = kb.SNAPSHOT
+    docs = [i for i in range(snap.n_docs) if i not in snap.deleted]  # removed recipes are not searchable
+    same_title: Dict[str, List[str]] = {}
+    for i in docs:
+        same_title.setdefault(kb.CORPUS.names[i].lower(), []).append(kb.CORPUS.ids[i])
+
+    queries = []
+    for kind in ("title_fragment", "ingredients", "perturbed_title"):
+        made = 0
+        for i in rng.sample(docs, len(docs)):
+            if made == n_per_kind:
+                break
+            name = kb.CORPUS.names[i]
+            title_words = kb.tokenize(name)
+            if kind == "title_fragment":
+                if len(title_words) < 2:
+                    continue
+                size = rng.randint(2, min(3, len(title_words)))
+                start = rng.randrange(len(title_words) - size + 1)
+                query = " ".join(title_words[start:start + size])
+            elif kind == "ingredients":
+                words = set(_ingredient_names(kb.CORPUS.raw_ingredients[i])) - set(title_words)
+                if len(words) < 3:
+                    continue
+                # The rarest words are the ones that point at this recipe rather than at any recipe
+                rarest = sorted(words, key=lambda w: (-snap.idf(kb.VOCAB_IDS[w]), w))[:4]
+                query = " ".join(rng.sample(rarest, 3))
+            else:
+                if not any(len(w) >= 4 for w in title_words):
+                    continue
+                perturbed = list(title_words)
+                long_words = [j for j, w in enumerate(title_words) if len(w) >= 4]
+                for j in rng.sample(long_words, min(2, len(long_words))):
+                    perturbed[j] = _perturb(perturbed[j], rng)
+                query = " ".join(perturbed)
+            queries.append({"kind": kind, "query": query, "source": kb.CORPUS.ids[i],
+                            "relevant": same_title[name.lower()]})
+            made += 1
+    return queries
+
+
+# ====== Scoring ======
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def evaluate_backend(search_fn: SearchFn, queries: List[Dict[str, Any]], k: int = 3,
+                     mrr_depth: int = 10, memory_sample: int = 50,
+                     index_size_fn: Callable[[], int] | None = None) -> Dict[str, Any]:
+    depth = max(k, mrr_depth)
+    latencies, recall, rr = [], [], []
+    per_kind: Dict[str, List[float]] = {}
+    for q in queries:
+        start = time.perf_counter()
+        hits = search_fn(q["query"], k=depth)
+        latencies.append(time.perf_counter() - start)
+
+        relevant = set(q["relevant"])
+        ranked = [h["id"] for h in hits]
+        found = len(relevant & set(ranked[:k]))
+        r = found / min(len(relevant), k)
+        recall.append(r)
+        rr.append(next((1.0 / rank for rank, doc_id in enumerate(ranked, 1) if doc_id in relevant), 0.0))
+        per_kind.setdefault(q["kind"], []).append(r)
+
+    # Memory is measured on a separate pass, since tracing allocations slows every query down
+    tracemalloc.start()
+    for q in queries[:memory_sample]:
+        search_fn(q["query"], k=depth)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = max(len(queries), 1)
+    return {
+        "queries": len(queries),
+        f"recall@{k}": sum(recall) / n,
+        "mrr": sum(rr) / n,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "peak_query_kb": peak / 1024,
+        "index_mb": index_size_fn() / 2**20 if index_size_fn else None,
+        "recall_by_kind": {kind: sum(v) / len(v) for kind, v in per_kind.items()},
+    }
+
+
+# ====== Report ======
+def format_table(results: Dict[str, Dict[str, Any]], k: int) -> str:
+    kinds = sorted({kind for r in results.values() for kind in r["recall_by_kind"]})
+    header = ["backend", f"recall@{k}", "MRR", "p50 ms", "p95 ms", "peak query KB", "index MB"] + [f"R@{k} {kind}" for kind in kinds]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for name, r in results.items():
+        row = [name, f"{r[f'recall@{k}']:.3f}", f"{r['mrr']:.3f}", f"{r['p50_ms']:.2f}",
+               f"{r['p95_ms']:.2f}", f"{r['peak_query_kb']:.0f}",
+               f"{r['index_mb']:.1f}" if r["index_mb"] is not None else "-"]
+        row += [f"{r['recall_by_kind'].get(kind, 0.0):.3f}" for kind in kinds]
+        lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines)
+
+def run_benchmark(backends: Dict[str, SearchFn] | None = None, n_per_kind: int = 200,
+                  k: int = 3, seed: int = 0,
+                  index_sizes: Dict[str, Callable[[], int]] | None = None) -> Dict[str, Dict[str, Any]]:
+    backends = backends or BACKENDS
+    index_sizes = INDEX_SIZE if index_sizes is None else index_sizes
+    queries = generate_queries(n_per_kind, seed)
+    print(f"Generated {len(queries)} labeled queries from {kb.SNAPSHOT.n_live} documents.")
+
+    results = {}
+    for name, search_fn in backends.items():
+        print(f"Benchmarking {name}...")
+        results[name] = evaluate_backend(search_fn, queries, k=k, index_size_fn=index_sizes.get(name))
+
+    # Save Results
+    results_dir = os.path.join("results", "benchmarks")
+    os.makedirs(results_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    table = format_table(results, k)
+    with open(os.path.join(results_dir, f"retrieval_{timestamp}.md"), "w", encoding="utf-8") as f:
+        f.write(table + "\n")
+    with open(os.path.join(results_dir, f"retrieval_{timestamp}.json"), "w", encoding="utf-8") as f:
+        json.dump({"k": k, "n_per_kind": n_per_kind, "seed": seed, "results": results}, f, indent=2)
+
+    print(table)
+    print(f"\n✅ Benchmark complete. Results saved to: {results_dir}")
+    return results
+
+if __name__ == "__main__":
+    run_benchmark()
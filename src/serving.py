@@ -0,0 +1,132 @@
+# Step 6: Serving many user sessions at once
+# The agent is stateless between runs (see RunState in agent_system.py), so a single instance with one
+# shared model can answer many sessions in parallel. AgentServer runs those sessions on a bounded pool
+# of worker threads: at most `workers` run at a time, at most `max_queue` more wait in line, and
+# anything beyond that is pushed back to the caller instead of piling up without limit.
+#
+# Generation itself is multi-threaded in torch. By default every generation keeps torch's threads, so a
+# single user gets the whole machine; under sustained load, `torch_threads` splits the cores between the
+# workers instead (at the cost of slower single requests).
+#
+# Usage (one query per line on stdin, one JSON result per line on stdout):
+#     python serving.py < queries.txt
+
+import json, os, sys, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+
+class ServerBusy(RuntimeError):
+    """Raised when the queue is full and no slot freed up within the submit timeout."""
+
+
+class AgentServer:
+    def __init__(self, agent: Any, workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 torch_threads: Optional[int] = None):
+        self.agent = agent
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_queue = max_queue if max_queue is not None else 4 * self.workers
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="agent-worker")
+        # One permit per running or waiting request: this is the backpressure
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._stats = {
+            "queued": 0, "running": 0, "completed": 0, "failed": 0, "rejected": 0, "timed_out": 0,
+            "max_queue_depth": 0, "total_wait": 0.0, "total_run": 0.0,
+        }
+
+        # torch's thread count is process-wide, so it is only changed when asked for
+        if torch_threads is not None and "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(torch_threads)
+
+    def submit(self, user_query: str, timeout: Optional[float] = None, deadline_s: Optional[float] = None) -> Future:
+        """Queue a query; blocks up to `timeout` seconds (forever if None) while the queue is full.
+        `deadline_s` is the run's latency budget, counted from now, so time spent queued is included."""
+        submitted = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise ServerBusy(f"{self.workers} workers busy and {self.max_queue} requests already queued")
+        with self._lock:
+            self._stats["queued"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._stats["queued"])
+        future = self._pool.submit(self._run, user_query, submitted, deadline_s)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, user_query: str, timeout: Optional[float] = None, deadline_s: Optional[float] = None) -> Dict[str, Any]:
+        """Submit a query and wait for its result."""
+        return self.submit(user_query, timeout=timeout, deadline_s=deadline_s).result()
+
+    def _run(self, user_query: str, enqueued_at: float, deadline_s: Optional[float]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with self._lock:
+            self._stats["queued"] -= 1
+            self._stats["running"] += 1
+            self._stats["total_wait"] += started - enqueued_at
+        ok = False
+        try:
+            if deadline_s is None:
+                result = self.agent.run(user_query)
+            else:
+                result = self.agent.run(user_query, deadline_s=deadline_s - (started - enqueued_at))
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                if ok and result.get("timed_out"):
+                    self._stats["timed_out"] += 1
+                self._stats["running"] -= 1
+                self._stats["completed" if ok else "failed"] += 1
+                self._stats["total_run"] += time.perf_counter() - started
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats["completed"] + stats["failed"]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": stats["queued"],
+            "running": stats["running"],
+            "completed": stats["completed"],
+            "failed": stats["failed"],
+            "rejected": stats["rejected"],
+            "timed_out": stats["timed_out"],
+            "max_queue_depth": stats["max_queue_depth"],
+            "avg_wait_s": stats["total_wait"] / done if done else 0.0,
+            "avg_run_s": stats["total_run"] / done if done else 0.0,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+def build_server(workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 torch_threads: Optional[int] = None) -> AgentServer:
+    # The same stack as the Streamlit app: retrieval fast path in front of the ReAct loop
+    import agent_system as ags
+    import knowledge_base as kb
+    import language_model as lm
+
+    agent = ags.ReActAgent(lm.LLM, kb.TOOLS, ags.AgentConfig(max_steps=6, verbose=False))
+    router = ags.RetrievalRouter(agent, kb.search_corpus, ags.RouterConfig(verbose=False), kb.query_words)
+    return AgentServer(router, workers=workers, max_queue=max_queue, torch_threads=torch_threads)
+
+
+if __name__ == "__main__":
+    # A full queue of queries keeps every worker busy, so here the cores are split between them
+    workers = min(4, os.cpu_count() or 1)
+    server = build_server(workers=workers, torch_threads=max(1, (os.cpu_count() or 1) // workers))
+    queries = [line.strip() for line in sys.stdin if line.strip()]
+    futures = [(q, server.submit(q)) for q in queries]
+    for query, future in futures:
+        try:
+            print(json.dumps(future.result(), ensure_ascii=False))
+        except Exception as e:
+            print(json.dumps({"question": query, "error": str(e)}, ensure_ascii=False))
+    server.shutdown()
+    print(json.dumps(server.metrics()), file=sys.stderr)